@@ -1,164 +1,232 @@
 #!/usr/bin/env python3
-import json
+import orjson
 import yaml
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import argparse
+import hashlib
 import sys
 import os
+import socket
+import struct
 from pathlib import Path
 import ipaddress
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import chain
+
+
+# Prefer the libyaml-backed loader when PyYAML was built with it
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+# Downloaded feeds are cached here and revalidated with ETag/Last-Modified
+CACHE_DIR = Path.home() / ".cache" / "zscaler_subnets"
+
+# Shared HTTP session so all downloads reuse pooled keep-alive connections
+SESSION = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=4,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504]),
+)
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
 
 
 def load_sources():
     """Load sources from sources.yaml file."""
     with open("sources.yaml", "r") as f:
-        return yaml.safe_load(f)
+        return yaml.load(f, Loader=SafeLoader)
+
+
+def _cache_paths(url):
+    """Return the cached body and metadata paths for a URL."""
+    key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    return CACHE_DIR / f"{key}.json", CACHE_DIR / f"{key}.meta"
+
+
+def _conditional_headers(url):
+    """Build If-None-Match / If-Modified-Since headers from the cache."""
+    body_path, meta_path = _cache_paths(url)
+    if not body_path.exists():
+        return {}
+    try:
+        meta = orjson.loads(meta_path.read_bytes())
+    except (OSError, orjson.JSONDecodeError):
+        return {}
+    headers = {}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+    return headers
+
+
+def _store_cache(url, response):
+    """Save a response body and its validators, ignoring cache write errors."""
+    body_path, meta_path = _cache_paths(url)
+    meta = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        body_path.write_bytes(response.content)
+        meta_path.write_bytes(orjson.dumps(meta))
+    except OSError as e:
+        print(f"Warning: could not cache response from {url}: {e}")
 
 
 def download_json(url):
-    """Download JSON from a URL."""
+    """Download JSON from a URL, reusing the cached copy if it is unchanged."""
     try:
-        response = requests.get(url, timeout=30)
+        response = SESSION.get(url, headers=_conditional_headers(url), timeout=30)
         response.raise_for_status()
-        return response.json()
+        if response.status_code == 304:
+            try:
+                return orjson.loads(_cache_paths(url)[0].read_bytes())
+            except (OSError, orjson.JSONDecodeError):
+                # Cached copy is unusable, fetch the full body again
+                response = SESSION.get(url, timeout=30)
+                response.raise_for_status()
+        data = orjson.loads(response.content)
     except requests.exceptions.RequestException as e:
         print(f"Error downloading from {url}: {e}")
         return None
+    except orjson.JSONDecodeError as e:
+        print(f"Error decoding JSON from {url}: {e}")
+        return None
+    _store_cache(url, response)
+    return data
 
 
 def parse_zscaler_hub_ips(data):
     """Parse ZscalerHubIPAddresses format JSON."""
-    ips = []
-    if data and "hubPrefixes" in data:
-        for ip in data["hubPrefixes"]:
-            # Filter out IPv6 addresses
-            if ":" not in ip:
-                # Add /32 for single IPs without CIDR notation
-                if "/" not in ip:
-                    ip += "/32"
-                ips.append(ip)
-    return ips
+    # Filter out IPv6 addresses
+    return [ip for ip in data.get("hubPrefixes", ()) if ":" not in ip]
 
 
 def parse_cloud_enforcement_nodes(data):
     """Parse CloudEnforcementNodeRanges format JSON."""
-    ips = []
-    if data and "prefixes" in data:
-        for ip in data["prefixes"]:
-            # Filter out IPv6 addresses
-            if ":" not in ip:
-                # Add /32 for single IPs without CIDR notation
-                if "/" not in ip:
-                    ip += "/32"
-                ips.append(ip)
-    return ips
+    # Filter out IPv6 addresses
+    return [ip for ip in data.get("prefixes", ()) if ":" not in ip]
 
 
 def parse_zpa_allowlist(data):
     """Parse ZPAAllowList format JSON."""
-    ips = []
-    if data and "content" in data:
-        for item in data["content"]:
-            if "IPs" in item:
-                for ip in item["IPs"]:
-                    # Filter out IPv6 addresses
-                    if ":" not in ip:
-                        # Add /32 for single IPs without CIDR notation
-                        if "/" not in ip:
-                            ip += "/32"
-                        ips.append(ip)
-    return ips
+    # Filter out IPv6 addresses
+    return [ip for item in data.get("content", ()) for ip in item.get("IPs", ()) if ":" not in ip]
 
 
 def parse_zia_svpn(data):
     """Parse ZIA Application Connector Tunnel (SVPN) format JSON."""
-    ips = []
-    if data and "svpnIPs" in data:
-        for ip in data["svpnIPs"]:
-            # Filter out IPv6 addresses
-            if ":" not in ip:
-                # Add /32 for single IPs without CIDR notation
-                if "/" not in ip:
-                    ip += "/32"
-                ips.append(ip)
-    return ips
+    # Filter out IPv6 addresses
+    return [ip for ip in data.get("svpnIPs", ()) if ":" not in ip]
 
 
 def read_digicert_subnets():
     """Read DigiCert subnets from text file."""
-    subnets = []
     try:
-        with open("digicert-subnets.txt", "r") as f:
-            for line in f:
-                subnet = line.strip()
-                if subnet and ":" not in subnet:  # Skip IPv6
-                    subnets.append(subnet)
+        with open("digicert-subnets.txt", "rb") as f:
+            lines = f.read().split()
     except FileNotFoundError:
         print("Warning: digicert-subnets.txt not found")
-    return subnets
+        return []
+    # Skip IPv6, decode only the lines that are kept
+    return [line.decode("ascii", "replace") for line in lines if b":" not in line]
+
+
+# Network and host masks for every valid prefix length string, so parsing
+# validates the prefix with a single lookup
+_PREFIX_MASKS = {
+    str(prefix): ((0xFFFFFFFF << (32 - prefix)) & 0xFFFFFFFF, 0xFFFFFFFF >> prefix)
+    for prefix in range(33)
+}
+# Handle single IPs as /32
+_PREFIX_MASKS[""] = _PREFIX_MASKS["32"]
+
+_unpack_address = struct.Struct(">I").unpack
+
+
+def _parse_cidr(ip_str):
+    """Parse an IPv4 address or CIDR string into integer (start, end) bounds."""
+    address, _, prefix = ip_str.strip().partition("/")
+    masks = _PREFIX_MASKS.get(prefix)
+    if masks is None:
+        raise ValueError(f"'{prefix}' is not a valid prefix length")
+    network_mask, host_mask = masks
+    start = _unpack_address(socket.inet_pton(socket.AF_INET, address))[0] & network_mask
+    return start, start | host_mask
+
 
+def _merge_intervals(intervals):
+    """Merge overlapping or adjacent (start, end) intervals in a single sweep.
 
-def consolidate_networks(ip_list):
-    """Consolidate overlapping IPv4 networks."""
-    # Convert strings to IPv4Network objects
-    networks = []
+    The intervals must be sorted by start address. Any iterable is accepted,
+    so the sweep can consume a merged stream without materializing it.
+    """
+    merged = []
+    intervals = iter(intervals)
+    first = next(intervals, None)
+    if first is None:
+        return merged
+
+    append = merged.append
+    current_start, current_end = first
+    for start, end in intervals:
+        if start > current_end + 1:
+            append((current_start, current_end))
+            current_start, current_end = start, end
+        elif end > current_end:
+            # Overlaps or touches the current range, extend it
+            current_end = end
+    append((current_start, current_end))
+
+    return merged
+
+
+def _range_to_cidrs(start, end):
+    """Split an integer address range into (network, prefix) CIDR blocks."""
+    while start <= end:
+        # Largest block that is aligned on start and does not pass end
+        size = min(start & -start or 1 << 32, 1 << ((end - start + 1).bit_length() - 1))
+        yield start, 33 - size.bit_length()
+        start += size
+
+
+def parse_networks(ip_list):
+    """Parse IPv4 networks into a set of unique integer (start, end) intervals.
+
+    Networks are compared by value, so "10.0.0.1" and "10.0.0.1/32" are
+    treated as the same entry.
+    """
+    intervals = set()
     for ip_str in ip_list:
         try:
-            # Handle single IPs by adding /32
-            if "/" not in ip_str:
-                ip_str += "/32"
-            network = ipaddress.IPv4Network(ip_str.strip(), strict=False)
-            networks.append(network)
-        except (ipaddress.AddressValueError, ValueError) as e:
+            intervals.add(_parse_cidr(ip_str))
+        except (OSError, ValueError) as e:
             print(f"Error parsing address: {ip_str}: {e}")
             continue
-    
-    # Sort networks by network address
-    networks.sort(key=lambda x: x.network_address)
-    
-    # Consolidate networks
-    consolidated = []
-    if not networks:
-        return consolidated
-    
-    current = networks[0]
-    for next_net in networks[1:]:
-        # Check if networks overlap or are adjacent
-        if current.supernet_of(next_net):
-            # current already contains next_net
-            continue
-        elif next_net.supernet_of(current):
-            # next_net contains current
-            current = next_net
-        elif (current.network_address <= next_net.broadcast_address and 
-              next_net.network_address <= current.broadcast_address):
-            # Networks overlap, merge them
-            # Find the minimal supernet that covers both
-            first_ip = min(current.network_address, next_net.network_address)
-            last_ip = max(current.broadcast_address, next_net.broadcast_address)
-            
-            # Calculate the appropriate prefix length
-            try:
-                supernet_list = list(ipaddress.summarize_address_range(first_ip, last_ip))
-                if len(supernet_list) == 1:
-                    current = supernet_list[0]
-                else:
-                    # Can't merge into single subnet, keep separate
-                    consolidated.append(current)
-                    current = next_net
-            except:
-                consolidated.append(current)
-                current = next_net
-        else:
-            # No overlap, add current and move to next
-            consolidated.append(current)
-            current = next_net
-    
-    # Add the last network
-    consolidated.append(current)
-    
-    return consolidated
+    return intervals
+
+
+def consolidate_networks(intervals):
+    """Consolidate overlapping IPv4 networks given as (start, end) intervals.
+
+    Overlapping and adjacent intervals are merged before being split into
+    CIDR blocks, so sibling networks such as 10.0.0.0/25 and 10.0.0.128/25
+    come out as 10.0.0.0/24 and the result is the minimal CIDR cover.
+    """
+    # Summarize each merged range into the minimal list of CIDR blocks
+    return [
+        ipaddress.IPv4Network((network, prefix))
+        for start, end in _merge_intervals(sorted(intervals))
+        for network, prefix in _range_to_cidrs(start, end)
+    ]
 
 
 def select_service_type():
@@ -185,24 +253,19 @@ def select_domain(sources, service_type):
         sources: Sources dictionary from YAML
         service_type: 'zia' or 'zpa'
     """
-    domains = set()
-
     if service_type == 'zia':
         # Collect ZIA domains
-        for source_type in ["ZscalerHubIPAddresses", "CloudEnforcementNodeRanges", "ZIAApplicationConnectorTunnel"]:
-            if source_type in sources:
-                domains.update(sources[source_type].keys())
-        print("\nSelect ZIA cloud:")
+        source_types = ["ZscalerHubIPAddresses", "CloudEnforcementNodeRanges", "ZIAApplicationConnectorTunnel"]
+        title = "Select ZIA cloud:"
     else:  # zpa
         # Collect ZPA domains
-        if "ZPAAllowList" in sources:
-            domains.update(sources["ZPAAllowList"].keys())
-        print("\nSelect ZPA cloud:")
+        source_types = ["ZPAAllowList"]
+        title = "Select ZPA cloud:"
 
-    domains = sorted(list(domains))
+    domains = sorted({domain for source_type in source_types for domain in sources.get(source_type, ())})
 
-    for i, domain in enumerate(domains, 1):
-        print(f"{i}. {domain}")
+    # Print the whole menu at once
+    print("\n".join([f"\n{title}"] + [f"{i}. {domain}" for i, domain in enumerate(domains, 1)]))
 
     while True:
         try:
@@ -279,69 +342,59 @@ def main():
         else:
             output_file = f"{today}_{zia_clean}_subnet_consolidate.txt"
     
-    all_ips = []
+    sources_out = []
 
-    # Download ZIA sources
-    # Download ZscalerHubIPAddresses
+    # Collect the ZIA sources
+    jobs = []
     if "ZscalerHubIPAddresses" in sources and zia_domain in sources["ZscalerHubIPAddresses"]:
-        url = sources["ZscalerHubIPAddresses"][zia_domain]
-        print(f"\nDownloading ZscalerHubIPAddresses from {url}...")
-        data = download_json(url)
-        if data:
-            ips = parse_zscaler_hub_ips(data)
-            print(f"Found {len(ips)} IP ranges")
-            all_ips.extend(ips)
-
-    # Download CloudEnforcementNodeRanges
+        jobs.append(("ZscalerHubIPAddresses", parse_zscaler_hub_ips,
+                     sources["ZscalerHubIPAddresses"][zia_domain]))
     if "CloudEnforcementNodeRanges" in sources and zia_domain in sources["CloudEnforcementNodeRanges"]:
-        url = sources["CloudEnforcementNodeRanges"][zia_domain]
-        print(f"\nDownloading CloudEnforcementNodeRanges from {url}...")
-        data = download_json(url)
-        if data:
-            ips = parse_cloud_enforcement_nodes(data)
-            print(f"Found {len(ips)} IP ranges")
-            all_ips.extend(ips)
-
-    # Download ZIA Application Connector Tunnel 2.0 IPs
+        jobs.append(("CloudEnforcementNodeRanges", parse_cloud_enforcement_nodes,
+                     sources["CloudEnforcementNodeRanges"][zia_domain]))
     if "ZIAApplicationConnectorTunnel" in sources and zia_domain in sources["ZIAApplicationConnectorTunnel"]:
-        url = sources["ZIAApplicationConnectorTunnel"][zia_domain]
-        print(f"\nDownloading ZIA Application Connector Tunnel IPs from {url}...")
-        data = download_json(url)
-        if data:
-            ips = parse_zia_svpn(data)
-            print(f"Found {len(ips)} IP ranges")
-            all_ips.extend(ips)
-
-    # Download ZPA sources (if requested)
+        jobs.append(("ZIA Application Connector Tunnel IPs", parse_zia_svpn,
+                     sources["ZIAApplicationConnectorTunnel"][zia_domain]))
+
+    # Collect the ZPA sources (if requested)
     if include_zpa and "ZPAAllowList" in sources and zpa_domain in sources["ZPAAllowList"]:
-        url = sources["ZPAAllowList"][zpa_domain]
-        print(f"\nDownloading ZPAAllowList from {url}...")
-        data = download_json(url)
-        if data:
-            ips = parse_zpa_allowlist(data)
-            print(f"Found {len(ips)} IP ranges")
-            all_ips.extend(ips)
+        jobs.append(("ZPAAllowList", parse_zpa_allowlist, sources["ZPAAllowList"][zpa_domain]))
+
+    # Download all sources concurrently, they are independent of each other
+    if jobs:
+        print()
+        for name, _, url in jobs:
+            print(f"Downloading {name} from {url}...")
+        with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+            futures = {executor.submit(download_json, url): (name, parse) for name, parse, url in jobs}
+            for future in as_completed(futures):
+                name, parse = futures[future]
+                data = future.result()
+                if data:
+                    ips = parse(data)
+                    print(f"Found {len(ips)} IP ranges in {name}")
+                    sources_out.append(ips)
 
     # Add DigiCert subnets
     print("\nReading DigiCert subnets...")
     digicert_ips = read_digicert_subnets()
     print(f"Found {len(digicert_ips)} DigiCert subnets")
-    all_ips.extend(digicert_ips)
+    sources_out.append(digicert_ips)
     
     # Remove duplicates
-    print(f"\nTotal IP ranges collected: {len(all_ips)}")
-    all_ips = list(set(all_ips))
-    print(f"Unique IP ranges: {len(all_ips)}")
+    print(f"\nTotal IP ranges collected: {sum(map(len, sources_out))}")
+    intervals = parse_networks(chain.from_iterable(sources_out))
+    print(f"Unique IP ranges: {len(intervals)}")
     
     # Consolidate networks
     print("\nConsolidating overlapping networks...")
-    consolidated = consolidate_networks(all_ips)
+    consolidated = consolidate_networks(intervals)
     print(f"Consolidated to {len(consolidated)} networks")
 
-    # Write output
-    with open(output_file, "w") as f:
-        for network in consolidated:
-            f.write(f"{network}\n")
+    # Write output as a single preformatted blob
+    payload = "".join(f"{network}\n" for network in consolidated).encode("ascii")
+    with open(output_file, "wb") as f:
+        f.write(payload)
 
     print(f"\nResults saved to: {output_file}")
     print(f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")